@@ -8,14 +8,15 @@ from ... import config
 
 app: adsk.core.Application = adsk.core.Application.get()
 ui: adsk.core.UserInterface = app.userInterface
-design: adsk.fusion.Design = app.activeProduct
-root_comp: adsk.fusion.Component = design.rootComponent
 
 # TODO *** Specify the command identity information. ***
 CMD_ID = f"{config.COMPANY_NAME}_{config.ADDIN_NAME}_isogrid_cmd"
 CMD_NAME = "IsoGrid Generator"
 CMD_Description = "Generate an IsoGrid structure"
 
+# Custom event used to report failures after the command has finished executing.
+ERROR_EVENT_ID = f"{config.COMPANY_NAME}_{config.ADDIN_NAME}_isogrid_error"
+
 # Specify that the command will be promoted to the panel.
 IS_PROMOTED = True
 
@@ -27,6 +28,14 @@ COMMAND_BESIDE_ID = "ScriptsManagerCommand"
 # Resource location for command icons, here we assume a sub folder in this directory named "resources".
 ICON_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "")
 
+# Geometry constants of the equilateral triangle grid.
+SQRT3 = math.sqrt(3)
+SQRT3_OVER_2 = SQRT3 / 2
+
+# Corner buckets are 1e-4 cm wide, a vertex matches a corner within 1e-6 cm
+CORNER_BUCKET = 1e-4
+CORNER_TOLERANCE = 1e-6
+
 # Local list of event handlers used to maintain a reference so
 # they are not released and garbage collected.
 local_handlers = []
@@ -34,6 +43,11 @@ local_handlers = []
 
 # Executed when add-in is run.
 def start():
+    # Remove a definition left behind by a previous run so start() can be repeated.
+    existing_def = ui.commandDefinitions.itemById(CMD_ID)
+    if existing_def:
+        existing_def.deleteMe()
+
     # Create a command Definition.
     cmd_def = ui.commandDefinitions.addButtonDefinition(
         CMD_ID, CMD_NAME, CMD_Description, ICON_FOLDER
@@ -49,12 +63,22 @@ def start():
     # Get the panel the button will be created in.
     panel = workspace.toolbarPanels.itemById(PANEL_ID)
 
+    # Remove a control left behind by a previous run before adding it again.
+    existing_control = panel.controls.itemById(CMD_ID)
+    if existing_control:
+        existing_control.deleteMe()
+
     # Create the button command control in the UI after the specified existing command.
     control = panel.controls.addCommand(cmd_def, COMMAND_BESIDE_ID, False)
 
     # Specify if the command is promoted to the main toolbar.
     control.isPromoted = IS_PROMOTED
 
+    # Register the custom event used to show errors outside of the execute handler.
+    app.unregisterCustomEvent(ERROR_EVENT_ID)
+    error_event = app.registerCustomEvent(ERROR_EVENT_ID)
+    futil.add_handler(error_event, show_error)
+
 
 # Executed when add-in is stopped.
 def stop():
@@ -72,6 +96,9 @@ def stop():
     if command_definition:
         command_definition.deleteMe()
 
+    # Remove the error reporting event
+    app.unregisterCustomEvent(ERROR_EVENT_ID)
+
 
 def command_created(args: adsk.core.CommandCreatedEventArgs):
     futil.log(f"{CMD_NAME} Command Created Event")
@@ -112,9 +139,9 @@ def command_created(args: adsk.core.CommandCreatedEventArgs):
         adsk.core.ValueInput.createByReal(2.0),
     )
 
-    # Add a selection input for selecting a face
+    # Add a selection input for selecting a face, only planar faces can hold a sketch
     selection_input = inputs.addSelectionInput(
-        "face_selection", "Select Face", "Select a face to place the grid on"
+        "face_selection", "Select Face", "Select a planar face to place the grid on"
     )
     selection_input.addSelectionFilter(adsk.core.SelectionCommandInput.SolidFaces)
     selection_input.setSelectionLimits(1, 1)
@@ -142,200 +169,407 @@ def command_execute(args: adsk.core.CommandEventArgs):
     face_selection = adsk.fusion.BRepFace.cast(
         inputs.itemById("face_selection").selection(0).entity
     )
-    bounding_box = face_selection.boundingBox
+
+    # Stop before creating a sketch, a curved face cannot hold the grid
+    if not adsk.core.Plane.cast(face_selection.geometry):
+        futil.log("Selected face is not planar", force_console=True)
+        app.fireCustomEvent(ERROR_EVENT_ID, "Select a planar face for the grid")
+        return
 
     try:
-        sketches = root_comp.sketches
-        sketch = sketches.add(face_selection)
+        # Resolve the design when the command runs, the add-in may load before a document is open
+        design = adsk.fusion.Design.cast(app.activeProduct)
+        root_comp = design.rootComponent
+
+        build_isogrid(
+            root_comp,
+            face_selection,
+            thickness_input,
+            size_input,
+            height_input,
+            fillet_radius_input,
+            hole_size_input,
+        )
 
-        # Find the minX and minY of every profile in the existing sketch
-        min_point = sketch.modelToSketchSpace(bounding_box.minPoint)
-        max_point = sketch.modelToSketchSpace(bounding_box.maxPoint)
+        # Report completion in the Text Command window instead of a modal dialog
+        futil.log("Created shrunken triangles", force_console=True)
+
+    except Exception as _:
+        # Log now, but only show the message box once execute has returned
+        futil.handle_error(CMD_NAME)
+        app.fireCustomEvent(ERROR_EVENT_ID, traceback.format_exc())
+
+
+def build_isogrid(
+    root_comp,
+    face_selection,
+    thickness_input,
+    size_input,
+    height_input,
+    fillet_radius_input,
+    hole_size_input,
+):
+    # Builds the grid on the face, raising on failure so command_execute reports it
+    bounding_box = face_selection.boundingBox
+
+    sketches = root_comp.sketches
+    sketch = sketches.add(face_selection)
+
+    # Defer profile recomputation until all points and lines are added
+    sketch.isComputeDeferred = True
+
+    try:
+        # Find the sketch-space extent of the face. The sketch axes may point
+        # against the model axes, so sort the transformed corners per axis
+        corner_a = sketch.modelToSketchSpace(bounding_box.minPoint)
+        corner_b = sketch.modelToSketchSpace(bounding_box.maxPoint)
+        min_x, max_x = sorted((corner_a.x, corner_b.x))
+        min_y, max_y = sorted((corner_a.y, corner_b.y))
 
         # Grid size calculations
-        grid_width = math.floor((max_point.x - min_point.x) / size_input) + 1
-        grid_height = (
-            math.floor((max_point.y - min_point.y) / (size_input * math.sqrt(3) / 2))
-            + 1
+        half_size = size_input * 0.5
+        row_height = size_input * SQRT3_OVER_2
+        grid_width = math.floor((max_x - min_x) / size_input) + 1
+        grid_height = math.floor((max_y - min_y) / row_height) + 1
+
+        # Offsets that center the grid within the bounding box
+        grid_x = min_x + ((max_x - min_x) % size_input) / 2
+        grid_y = min_y + ((max_y - min_y) % row_height) / 2
+
+        # The grid is separable: x depends on the column (plus a half step on odd
+        # rows) and y only on the row, so compute each axis once
+        column_x = [grid_x + x * size_input for x in range(grid_width)]
+        row_y = [grid_y + y * row_height for y in range(grid_height)]
+
+        # Flat grid of None, the point at column x and row y is at x * grid_height + y
+        point_grid = [None] * (grid_width * grid_height)
+
+        triangle_corners = []  # Sketch coordinates of the shrunken triangle corners
+        model_point = adsk.core.Point3D.create(0, 0, 0)
+        is_point_on_face = face_selection.isPointOnFace
+
+        # Row-major sketch-to-model transform, applied in Python rather than
+        # calling sketchToModelSpace for every candidate point
+        m = sketch.transform.asArray()
+
+        # Clip each row to where it crosses the face's outer boundary so cells
+        # that are clearly off the face are never tested, isPointOnFace decides
+        # the rest. Inner loops can never move the outermost crossings. Each
+        # edge's sketch-space y-range is read once so a row only intersects
+        # the edges that can reach it.
+        outer_edges = [
+            (edge.geometry,) + sketch_y_range(edge.boundingBox, m)
+            for loop in face_selection.loops
+            if loop.isOuter
+            for edge in loop.edges
+        ]
+        row_direction = (m[0], m[4], m[8])
+        row_origin = adsk.core.Point3D.create(m[3], m[7], m[11])
+        row_line = adsk.core.InfiniteLine3D.create(
+            row_origin, adsk.core.Vector3D.create(*row_direction)
         )
+        for y in range(grid_height):
+            py = row_y[y]
+            row_shift = half_size if y % 2 else 0.0
+            x_start, x_end = 0, grid_width
+            row_curves = [
+                curve for curve, low_y, high_y in outer_edges if low_y <= py <= high_y
+            ]
+            extent = None
+            if row_curves:
+                origin = (m[1] * py + m[3], m[5] * py + m[7], m[9] * py + m[11])
+                row_origin.set(*origin)
+                row_line.origin = row_origin
+                extent = row_extent(row_line, row_curves, origin, row_direction)
+            if extent:
+                low, high = extent
+                x_start = max(
+                    0, math.ceil((low - grid_x - row_shift) / size_input - 1e-6)
+                )
+                x_end = min(
+                    grid_width,
+                    math.floor((high - grid_x - row_shift) / size_input + 1e-6) + 1,
+                )
 
-        # Initialize a 2D array of None
-        point_grid = [[None for _ in range(grid_height)] for _ in range(grid_width)]
-
-        # Grid of points centered at center_point
-        hole_points = adsk.core.ObjectCollection.create()
-        triangle_lines = []  # List to store the lines forming triangles
-        for x in range(grid_width):
-            for y in range(grid_height):
-                point = adsk.core.Point3D.create(
-                    min_point.x
-                    + x * size_input
-                    + ((max_point.x - min_point.x) % size_input) / 2
-                    + (y % 2) * size_input / 2,
-                    min_point.y
-                    + y * (size_input * math.sqrt(3) / 2)
-                    + ((max_point.y - min_point.y) % (size_input * math.sqrt(3) / 2))
-                    / 2,
-                    0,
+            # Keep the row cells that land on the face
+            for x in range(x_start, x_end):
+                px = column_x[x] + row_shift
+                model_point.set(
+                    m[0] * px + m[1] * py + m[3],
+                    m[4] * px + m[5] * py + m[7],
+                    m[8] * px + m[9] * py + m[11],
                 )
-                if face_selection.isPointOnFace(sketch.sketchToModelSpace(point)):
-                    point_grid[x][y] = sketch.sketchPoints.add(point)
-                    hole_points.add(point_grid[x][y])
-
-        # Create triangles by connecting adjacent points
-        for x in range(len(point_grid) - 1):
-            for y in range(len(point_grid[x]) - 1):
-                if y % 2 == 1:
-                    triangle_lines.extend(
-                        draw_shrunken_triangle(
-                            sketch,
-                            point_grid[x][y],
-                            point_grid[x + 1][y],
-                            point_grid[x + 1][y + 1],
-                            thickness_input,
-                        )
-                    )
-                    triangle_lines.extend(
-                        draw_shrunken_triangle(
-                            sketch,
-                            point_grid[x][y],
-                            point_grid[x + 1][y + 1],
-                            point_grid[x][y + 1],
-                            thickness_input,
-                        )
-                    )
-                else:
-                    triangle_lines.extend(
-                        draw_shrunken_triangle(
-                            sketch,
-                            point_grid[x][y],
-                            point_grid[x + 1][y],
-                            point_grid[x][y + 1],
-                            thickness_input,
-                        )
-                    )
-                    triangle_lines.extend(
-                        draw_shrunken_triangle(
-                            sketch,
-                            point_grid[x + 1][y],
-                            point_grid[x + 1][y + 1],
-                            point_grid[x][y + 1],
-                            thickness_input,
-                        )
+                if is_point_on_face(model_point):
+                    # Keep the coordinates so triangles never read back .geometry
+                    point_grid[x * grid_height + y] = (px, py)
+
+        # Every up-pointing triangle is a translation of the same shrunken
+        # triangle, and likewise every down-pointing one, so shrink both once.
+        # Moving each corner thickness towards the centroid of an equilateral
+        # triangle (circumradius size / sqrt(3)) is a uniform scale about it.
+        shrink_scale = 1 - SQRT3 * thickness_input / size_input
+        up_shape = shrink_triangle(
+            [(0, 0), (size_input, 0), (half_size, row_height)], shrink_scale
+        )
+        down_shape = shrink_triangle(
+            [(0, 0), (half_size, row_height), (-half_size, row_height)],
+            shrink_scale,
+        )
+
+        # Create triangles by connecting adjacent points, odd rows are shifted
+        # half a triangle to the right so each row parity has its own pairing.
+        # The first point of each triangle is the anchor its shape is placed at.
+        triangles = []
+        for y in range(0, grid_height - 1, 2):
+            for x in range(grid_width - 1):
+                # Neighbours of a cell are at +1 (next row) and +H (next column)
+                base = x * grid_height + y
+                here, right = point_grid[base], point_grid[base + grid_height]
+                up, up_right = (
+                    point_grid[base + 1],
+                    point_grid[base + grid_height + 1],
+                )
+                triangles.append((here, right, up, up_shape))
+                triangles.append((right, up_right, up, down_shape))
+        for y in range(1, grid_height - 1, 2):
+            for x in range(grid_width - 1):
+                base = x * grid_height + y
+                here, right = point_grid[base], point_grid[base + grid_height]
+                up, up_right = (
+                    point_grid[base + 1],
+                    point_grid[base + grid_height + 1],
+                )
+                triangles.append((here, right, up_right, up_shape))
+                triangles.append((here, up_right, up, down_shape))
+
+        # Bounding box centers of the triangles sit on a lattice of half a
+        # triangle by one row, which identifies their profiles without areas
+        lattice = (grid_x, grid_y, half_size, row_height)
+        triangle_keys = set()
+        add_line = sketch.sketchCurves.sketchLines.addByTwoPoints
+        create_point = adsk.core.Point3D.create
+        for p1, p2, p3, shape in triangles:
+            if p1 and p2 and p3:
+                triangle_corners.extend(
+                    draw_triangle_shape(add_line, create_point, p1, shape)
+                )
+                xs = (p1[0], p2[0], p3[0])
+                ys = (p1[1], p2[1], p3[1])
+                triangle_keys.add(
+                    lattice_key(
+                        (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2, lattice
                     )
+                )
 
-        # adds every profile with area equal to shrunken triangle area to the combined_profiles collection
-        combined_profiles = adsk.core.ObjectCollection.create()
-        triangle_area = (
-            (math.sqrt(3) * size_input**2) / 4
-            + (3 * math.sqrt(3) * thickness_input**2) / 4
-            - (3 * size_input * thickness_input) / 2
+        # Add the hole centers in one pass once all lines are drawn
+        hole_points = []
+        point = adsk.core.Point3D.create(0, 0, 0)  # Reused, sketch points copy it
+        add_sketch_point = sketch.sketchPoints.add
+        for coordinates in point_grid:
+            if coordinates:
+                point.set(coordinates[0], coordinates[1], 0)
+                hole_points.append(add_sketch_point(point))
+    finally:
+        # Profiles are only valid after the sketch recomputes, so this must
+        # run before sketch.profiles is read below
+        sketch.isComputeDeferred = False
+
+    # Select the profiles whose bounding box matches a drawn shrunken triangle.
+    # A triangle that crosses a projected face edge is split, and its on-face
+    # piece can keep the full width and lattice cell, so also require a single
+    # three-sided loop. That check only runs for lattice matches.
+    shrunken_side = size_input - SQRT3 * thickness_input
+    tolerance = size_input * 1e-3
+    matching_profiles = []
+    for profile in sketch.profiles:
+        box = profile.boundingBox
+        min_box, max_box = box.minPoint, box.maxPoint
+        if abs(max_box.x - min_box.x - shrunken_side) > tolerance:
+            continue
+        key = lattice_key(
+            (min_box.x + max_box.x) / 2, (min_box.y + max_box.y) / 2, lattice
         )
-        for profile in sketch.profiles:
-            if abs(profile.areaProperties().area - triangle_area) < 1e-6:
-                combined_profiles.add(profile)
-
-        if combined_profiles.count != 0:
-            ext_input = root_comp.features.extrudeFeatures.createInput(
-                combined_profiles, adsk.fusion.FeatureOperations.CutFeatureOperation
-            )
-            ext_input.setDistanceExtent(
-                False, adsk.core.ValueInput.createByReal(-height_input)
+        if key not in triangle_keys:
+            continue
+        loops = profile.profileLoops
+        if loops.count == 1 and loops.item(0).profileCurves.count == 3:
+            matching_profiles.append(profile)
+    combined_profiles = create_collection(matching_profiles)
+
+    if combined_profiles.count != 0:
+        extrude_features = root_comp.features.extrudeFeatures
+        ext_input = extrude_features.createInput(
+            combined_profiles, adsk.fusion.FeatureOperations.CutFeatureOperation
+        )
+        ext_input.setDistanceExtent(
+            False, adsk.core.ValueInput.createByReal(-height_input)
+        )
+        extrude_features.add(ext_input)
+
+    # A zero radius means no fillet, so skip the edge scan entirely
+    if fillet_radius_input > 0:
+        # Bucket the model-space triangle corners so each body edge is checked
+        # against a handful of nearby corners instead of every triangle line
+        corner_buckets = {}
+        for cx, cy in triangle_corners:
+            add_corner(
+                corner_buckets,
+                m[0] * cx + m[1] * cy + m[3],
+                m[4] * cx + m[5] * cy + m[7],
+                m[8] * cx + m[9] * cy + m[11],
             )
-            root_comp.features.extrudeFeatures.add(ext_input)
-
-        # Filter vertical edges that match the triangle edges
-        edges = adsk.core.ObjectCollection.create()
-        for edge in face_selection.body.edges:
-            for line in triangle_lines:
-                # Check if the edge shares the same xy coordinates with the triangle line
-                if (
-                    not edge.startVertex.geometry.isEqualTo(edge.endVertex.geometry)
-                    and abs(edge.startVertex.geometry.x - edge.endVertex.geometry.x)
-                    < 1e-6
-                    and abs(edge.startVertex.geometry.y - edge.endVertex.geometry.y)
-                    < 1e-6
-                    and (
-                        edge.startVertex.geometry.isEqualTo(
-                            line.startSketchPoint.worldGeometry
-                        )
-                        or edge.endVertex.geometry.isEqualTo(
-                            line.endSketchPoint.worldGeometry
-                        )
-                        or edge.endVertex.geometry.isEqualTo(
-                            line.endSketchPoint.worldGeometry
-                        )
-                        or edge.endVertex.geometry.isEqualTo(
-                            line.startSketchPoint.worldGeometry
-                        )
-                    )
-                ):
-                    edges.add(edge)
-                    break
+
+        # Keep the edges that run along the sketch normal from a triangle corner.
+        # The pocket corners are inside corners, so only concave edges can match.
+        normal = (m[2], m[6], m[10])
+        edges = []
+        for edge in face_selection.body.concaveEdges:
+            # One asArray call per vertex instead of reading x, y and z
+            sx, sy, sz = edge.startVertex.geometry.asArray()
+            ex, ey, ez = edge.endVertex.geometry.asArray()
+            dx, dy, dz = ex - sx, ey - sy, ez - sz
+            length_sq = dx * dx + dy * dy + dz * dz
+            along = dx * normal[0] + dy * normal[1] + dz * normal[2]
+
+            # Reject degenerate edges and edges more than 1e-6 off the normal
+            if length_sq < 1e-12 or length_sq - along * along > 1e-12:
+                continue
+            if is_near_corner(corner_buckets, sx, sy, sz) or is_near_corner(
+                corner_buckets, ex, ey, ez
+            ):
+                edges.append(edge)
 
         # Fillet the vertical edges
-        if edges.count != 0:
-            fillet_input = root_comp.features.filletFeatures.createInput()
+        if edges:
+            fillet_features = root_comp.features.filletFeatures
+            fillet_input = fillet_features.createInput()
             fillet_input.addConstantRadiusEdgeSet(
-                edges, adsk.core.ValueInput.createByReal(fillet_radius_input), True
-            )
-            root_comp.features.filletFeatures.add(fillet_input)
-
-        if hole_points.count != 0:
-            hole_input = root_comp.features.holeFeatures.createSimpleInput(
-                adsk.core.ValueInput.createByReal(hole_size_input)
-            )
-            hole_input.setPositionBySketchPoints(hole_points)
-            hole_input.setDistanceExtent(
-                adsk.core.ValueInput.createByReal(height_input)
+                create_collection(edges),
+                adsk.core.ValueInput.createByReal(fillet_radius_input),
+                True,
             )
-            root_comp.features.holeFeatures.add(hole_input)
+            fillet_features.add(fillet_input)
 
-        ui.messageBox("Created shrunken triangles")
+    if hole_points:
+        hole_features = root_comp.features.holeFeatures
+        hole_input = hole_features.createSimpleInput(
+            adsk.core.ValueInput.createByReal(hole_size_input)
+        )
+        hole_input.setPositionBySketchPoints(create_collection(hole_points))
+        hole_input.setDistanceExtent(adsk.core.ValueInput.createByReal(height_input))
+        hole_features.add(hole_input)
+
+
+def row_extent(line, curves, origin, direction):
+    # Returns the (min, max) distance along direction at which line crosses any
+    # of the curves, or None when it crosses none. origin and direction are the
+    # line's (x, y, z) floats so each hit is measured without further API reads
+    ox, oy, oz = origin
+    dx, dy, dz = direction
+    distances = []
+    for curve in curves:
+        for hit in line.intersectWithCurve(curve):
+            hx, hy, hz = hit.asArray()
+            distances.append((hx - ox) * dx + (hy - oy) * dy + (hz - oz) * dz)
+    if not distances:
+        return None
+    return min(distances), max(distances)
+
+
+def sketch_y_range(box, m):
+    # Returns the (min, max) sketch y of a model-space bounding box, padded by
+    # 1e-6 so edges that only touch a row are still intersected with it
+    min_point = box.minPoint.asArray()
+    max_point = box.maxPoint.asArray()
+    low = high = -(m[1] * m[3] + m[5] * m[7] + m[9] * m[11])
+    for axis, a, b in zip((m[1], m[5], m[9]), min_point, max_point):
+        low += min(axis * a, axis * b)
+        high += max(axis * a, axis * b)
+    return low - 1e-6, high + 1e-6
+
+
+def lattice_key(center_x, center_y, lattice):
+    # Snap a triangle's bounding box center to its (half column, row) cell
+    origin_x, origin_y, half_size, row_height = lattice
+    return (
+        round((center_x - origin_x) / half_size),
+        math.floor((center_y - origin_y) / row_height),
+    )
 
-    except Exception as _:
-        if ui:
-            ui.messageBox("Failed:\n{}".format(traceback.format_exc()))
-
-
-def draw_shrunken_triangle(sketch, p1, p2, p3, thickness):
-    if p1 and p2 and p3:
-        # Extract geometries
-        pts = [p1.geometry, p2.geometry, p3.geometry]
-
-        # Calculate centroid
-        centroid_x = sum(pt.x for pt in pts) / 3
-        centroid_y = sum(pt.y for pt in pts) / 3
-
-        # Shrink each point towards the centroid
-        new_points = []
-        for pt in pts:
-            dx = centroid_x - pt.x
-            dy = centroid_y - pt.y
-            length = (dx**2 + dy**2) ** 0.5
-            if length == 0:
-                new_pt = pt
-            else:
-                dx_norm = dx / length
-                dy_norm = dy / length
-                new_pt = adsk.core.Point3D.create(
-                    pt.x + dx_norm * thickness, pt.y + dy_norm * thickness, 0
-                )
-            new_points.append(new_pt)
 
-        # Draw the shrunken triangle
-        line1 = sketch.sketchCurves.sketchLines.addByTwoPoints(
-            new_points[0], new_points[1]
-        )
-        line2 = sketch.sketchCurves.sketchLines.addByTwoPoints(
-            new_points[1], new_points[2]
+def add_corner(buckets, x, y, z):
+    # File the corner under every bucket its tolerance box touches, so a
+    # vertex only has to look in the one bucket it falls in
+    corner = (x, y, z)
+    ranges = [
+        range(
+            math.floor((v - CORNER_TOLERANCE) / CORNER_BUCKET),
+            math.floor((v + CORNER_TOLERANCE) / CORNER_BUCKET) + 1,
         )
-        line3 = sketch.sketchCurves.sketchLines.addByTwoPoints(
-            new_points[2], new_points[0]
+        for v in corner
+    ]
+    for i in ranges[0]:
+        for j in ranges[1]:
+            for k in ranges[2]:
+                buckets.setdefault((i, j, k), []).append(corner)
+
+
+def is_near_corner(buckets, x, y, z):
+    # The bucket only picks candidates, the tolerance check decides
+    key = (
+        math.floor(x / CORNER_BUCKET),
+        math.floor(y / CORNER_BUCKET),
+        math.floor(z / CORNER_BUCKET),
+    )
+    for cx, cy, cz in buckets.get(key, ()):
+        if (
+            abs(x - cx) <= CORNER_TOLERANCE
+            and abs(y - cy) <= CORNER_TOLERANCE
+            and abs(z - cz) <= CORNER_TOLERANCE
+        ):
+            return True
+    return False
+
+
+def create_collection(items):
+    # Build an ObjectCollection in one pass, binding the add method once
+    collection = adsk.core.ObjectCollection.create()
+    add = collection.add
+    for item in items:
+        add(item)
+    return collection
+
+
+def shrink_triangle(points, scale):
+    # Scale the (x, y) corners of a triangle about its centroid
+    centroid_x = sum(pt[0] for pt in points) / 3
+    centroid_y = sum(pt[1] for pt in points) / 3
+    return [
+        (
+            centroid_x + (pt[0] - centroid_x) * scale,
+            centroid_y + (pt[1] - centroid_y) * scale,
         )
+        for pt in points
+    ]
+
+
+def draw_triangle_shape(add_line, create_point, anchor, shape):
+    # Translate the precomputed shrunken shape to the anchor point
+    corners = [(anchor[0] + dx, anchor[1] + dy) for dx, dy in shape]
+
+    new_points = [create_point(x, y, 0) for x, y in corners]
+
+    # Draw the shrunken triangle
+    add_line(new_points[0], new_points[1])
+    add_line(new_points[1], new_points[2])
+    add_line(new_points[2], new_points[0])
+
+    return corners  # Return the corners of the shrunken triangle
+
 
-        return [line1, line2, line3]  # Return the lines created by the triangle
-    return []
+# This event handler is called when a failure was reported by command_execute.
+def show_error(args: adsk.core.CustomEventArgs):
+    ui.messageBox("Failed:\n{}".format(args.additionalInfo))
 
 
 # This event handler is called when the command terminates.